@@ -1,19 +1,41 @@
+import hashlib
+import io
 import os
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
 import requests
+from requests.adapters import HTTPAdapter
 import sys
 import threading
-from time import sleep
+from time import monotonic
 from datetime import datetime as dt
 from PIL import Image
-from typing import NoReturn, Optional, Tuple
+from typing import NoReturn, Optional, Set, Tuple
 from zoneinfo import ZoneInfo
 
+from lib.arg_parser import args
 from lib.display_settings import DisplaySettings, display_settings
 from lib.draw import Draw
 from lib.spotify_user import SpotifyTrackMetadata, SpotifyUser
 from lib.clock_logging import logger
 
+PACIFIC_TZ = ZoneInfo("America/Los_Angeles")
+
+ALBUM_ART_DIR = "cache/album_art/"
+ALBUM_ART_CACHE_SIZE = 50
+ALBUM_ART_SIZE = (120, 120)
+FRAME_HASH_PATH = "cache/frame_hash.bin"
+# Written by older versions that kept a single album image and an ImageMagick palette, no longer used
+LEGACY_ALBUM_ART_FILES = ("AlbumImage.PNG", "AlbumImage_resize.PNG", "AlbumImage_dither.PNG", "palette.PNG")
+
+# Reused across album art downloads so the CDN connection is kept alive
+_session = requests.Session()
+_session.mount("https://", HTTPAdapter(pool_connections=2, pool_maxsize=4))
+
 class Calendar:
+    # Directories already created by ensure_dir()
+    _ensured_dirs: Set[str] = set()
+
     def __init__(self) -> None:
         logger.info("\n\t-- Calendar Init --\n-----------------------------------------------------------------------------------------------------")
         self.local_run: bool = False
@@ -28,11 +50,26 @@ class Calendar:
         if not self.local_run:
             self.epd = epd2in7_V2.EPD()
         self.did_epd_init: bool = False
+        self._epd_init_deadline: float = 0.0
 
         # Initialize Info/Drawing Libs/Users
         self.image_obj: Draw = Draw(self.local_run)
         self.spotify_user: SpotifyUser = SpotifyUser()
 
+        # Names of the cached album art files, least recently used first
+        self._album_art_lru: OrderedDict = self.scan_album_art_cache()
+
+        # Downloads album art while the rest of the image is drawn, kept alive across draws
+        self._pool = ThreadPoolExecutor(max_workers=1)
+        # Album art loaded in the background by prefetch_album_art()
+        self._art_future: Optional[Future] = None
+        # Hash of the EPD buffer currently on the panel, persisted since the panel keeps its image across reboots
+        self._last_frame_hash: Optional[bytes] = self.read_frame_hash()
+        # monotonic() of the last redraw, immune to NTP jumps; None until this process has drawn once
+        self._last_draw_monotonic: Optional[float] = None
+        # Draw.get_calendar_key() of the last redraw
+        self._last_calendar_key: Optional[tuple] = None
+
 
     def save_local_file(self, file_name="output") -> None:
         """
@@ -49,13 +86,14 @@ class Calendar:
         except RuntimeError as e:
             logger.error("Failed to init EPD: %s", e)
 
-    def draw(self):
-        start = dt.now()
+    def draw(self) -> bool:
+        # The time is read once per draw and shared by the staleness check and the calendar
+        start = dt.now(PACIFIC_TZ)
+        start_timestamp = start.timestamp()
 
-        # If track info has changed from cache or is > 1h stale, draw new image.
+        # If track info has changed from cache, or is > 1h stale and the calendar changed, draw new image.
         last_drawn_track = self.spotify_user.read_track_from_cache()
         most_recent_track = self.spotify_user.get_most_recent_spotipy_info()
-        should_download_album = True
         should_redraw = True
         if most_recent_track is None:
             logger.warning("Failed to fetch Spotify info remotely, reading from cache...")
@@ -68,66 +106,125 @@ class Calendar:
                     context_name="N/A",
                     track_image_link="N/A",
                     album_name="N/A",
-                    timestamp=dt.now(),
+                    timestamp=start_timestamp,
                 )
             else:
                 logger.info(f"Successfully fetched last track from cache: {last_drawn_track}")
                 most_recent_track = last_drawn_track
                 should_redraw = False
         if most_recent_track is not None and last_drawn_track is not None:
-            time_elapsed_since_last_draw = dt.now() - dt.fromtimestamp(last_drawn_track.timestamp)
+            if self._last_draw_monotonic is not None:
+                since_last_draw = monotonic() - self._last_draw_monotonic
+            else:
+                # Nothing drawn by this process yet, fall back to the cached track's wall-clock timestamp
+                since_last_draw = start_timestamp - last_drawn_track.timestamp
+            # Same track an hour later only needs a redraw if the calendar panel would change
+            calendar_changed = self.image_obj.get_calendar_key(start) != self._last_calendar_key
             should_redraw = (
                 last_drawn_track != most_recent_track
-                or time_elapsed_since_last_draw.total_seconds() > 3600
+                or (since_last_draw > 3600 and calendar_changed)
             )
-            should_download_album = (
-                last_drawn_track.album_name != most_recent_track.album_name
-            )
-            logger.info(f"should_redraw={should_redraw}, should_download_album={should_download_album} based on cached track: {last_drawn_track}")
+            logger.info(f"should_redraw={should_redraw} based on cached track: {last_drawn_track}")
         if should_redraw:
+            self.prefetch_album_art(most_recent_track)
+            # Initialize the EPD while the image is being built
+            epd_init_thread = self.start_epd_init()
             self.image_obj.clear_image()
-            self.build_image(most_recent_track, should_download_album)
-            if not self.did_epd_init and not self.local_run:
-                # try initing the EPD for a total of 45 seconds
-                thread = threading.Thread(target=self.init_epd)
-                thread.start()
-                thread.join(45)
-                if thread.is_alive():
-                    logger.error("Failed to init EPD in 45 seconds, exiting.")
-                    sys.exit(1)
-                else:
-                    logger.info("EPD initialized.")
-
-                if self.ds.four_gray_scale:
-                    logger.info("Initializing EPD 4Gray...")
-                    self.epd.Init_4Gray()
-                    logger.info("Done initializing EPD 4Gray.")
-                
-                self.did_epd_init = True
-
-            if self.did_epd_init and not self.local_run:
-                logger.info("Drawing image to EPD...")
-                if self.ds.four_gray_scale:
-                    self.epd.display_4Gray(self.epd.getbuffer_4Gray(self.image_obj.get_image_obj()))
-                else:
-                    self.epd.display(self.epd.getbuffer(self.image_obj.get_image_obj()))
-                logger.info("Done drawing to EPD.")
+            self.build_image(most_recent_track, start)
+            if not self.local_run:
+                self.display_image(epd_init_thread)
             self.spotify_user.write_track_to_cache(most_recent_track)
+            self._last_draw_monotonic = monotonic()
+            self._last_calendar_key = self.image_obj.get_calendar_key(start)
+            self.evict_album_art_cache()
 
         if self.did_epd_init and self.ds.sleep_epd:
             logger.info("Sleeping EPD.")
             self.epd.sleep()
             self.did_epd_init = False
         
-        end = dt.now()
+        end = dt.now(PACIFIC_TZ)
         time_elapsed = end - start
         logger.info(f"draw() took {time_elapsed.total_seconds()} seconds")
+        return should_redraw
+
+
+    def start_epd_init(self) -> Optional[threading.Thread]:
+        """
+        Starts initializing the EPD in a background thread, unless it is already initialized.
+        """
+        if self.did_epd_init or self.local_run:
+            return None
+        self._epd_init_deadline = monotonic() + 45
+        thread = threading.Thread(target=self.init_epd)
+        thread.start()
+        return thread
+
+    def display_image(self, epd_init_thread: Optional[threading.Thread] = None) -> None:
+        """
+        Sends the built image to the EPD, finishing its initialization if needed.
+        The refresh is skipped entirely if the EPD buffer is identical to what the panel already shows.
+        """
+        # Pack the buffer first, so it overlaps with the EPD initializing in the background
+        image = self.image_obj.get_image_obj()
+        if self.ds.four_gray_scale:
+            buf = self.epd.getbuffer_4Gray(image)
+        else:
+            buf = self.epd.getbuffer(image)
+
+        if not self.did_epd_init:
+            if epd_init_thread is None:
+                epd_init_thread = self.start_epd_init()
+            # try initing the EPD for a total of 45 seconds
+            epd_init_thread.join(max(0, self._epd_init_deadline - monotonic()))
+            if epd_init_thread.is_alive():
+                logger.error("Failed to init EPD in 45 seconds, exiting.")
+                sys.exit(1)
+            else:
+                logger.info("EPD initialized.")
+
+            if self.ds.four_gray_scale:
+                logger.info("Initializing EPD 4Gray...")
+                self.epd.Init_4Gray()
+                logger.info("Done initializing EPD 4Gray.")
+            
+            self.did_epd_init = True
+
+        frame_hash = hashlib.blake2b(bytes(buf), digest_size=8).digest()
+        if frame_hash == self._last_frame_hash:
+            logger.info("EPD buffer unchanged, skipping refresh.")
+            return
+
+        logger.info("Drawing image to EPD...")
+        if self.ds.four_gray_scale:
+            self.epd.display_4Gray(buf)
+        else:
+            self.epd.display(buf)
+        logger.info("Done drawing to EPD.")
+        self.write_frame_hash(frame_hash)
+
+
+    def read_frame_hash(self) -> Optional[bytes]:
+        try:
+            with open(FRAME_HASH_PATH, 'rb') as f:
+                return f.read()
+        except FileNotFoundError:
+            return None
+
+
+    def write_frame_hash(self, frame_hash: bytes) -> None:
+        self._last_frame_hash = frame_hash
+        try:
+            with open(FRAME_HASH_PATH, 'wb') as f:
+                f.write(frame_hash)
+        except OSError as e:
+            logger.error(f"Error writing {FRAME_HASH_PATH}: {e}")
 
 
     def build_image(
             self, 
             track: Optional[SpotifyTrackMetadata] = None,
-            should_download_album: bool = True,
+            now: Optional[dt] = None,
         ) -> None:
         """
         Main draw function for the ePaper display.
@@ -136,50 +233,118 @@ class Calendar:
         if track is None:
             track = self.spotify_user.get_most_recent_spotipy_info()
             logger.info(f"Fetched most recent Spotify track: {track}")
-        self.build_album_art(track, should_download_album, (0, 0))
+        # Album art is drawn last so that a prefetch can overlap with drawing the text
         self.build_track_info(track, 120, 120)
-        self.build_calendar(0, 120)
-        self.save_local_file()  # save image locally for debugging
+        self.build_calendar(0, 120, now)
+        self.build_album_art(track, (0, 0))
+        if self.local_run or args.local or self.ds.debug_save_png:
+            self.save_local_file()  # save image locally for debugging
 
 
-    def build_calendar(self, x: int, y: int) -> None:
-        pacific_tz = ZoneInfo("America/Los_Angeles")
-        pacific_now = dt.now(pacific_tz)
+    def build_calendar(self, x: int, y: int, now: Optional[dt] = None) -> None:
+        pacific_now = now if now is not None else dt.now(PACIFIC_TZ)
         self.image_obj.draw_calendar(pacific_now, x, y)
 
 
     def build_album_art(
         self, 
         track: SpotifyTrackMetadata,
-        should_download_album: str,
         pos: Tuple[int, int],
     ) -> None:
-        did_refresh_album_art = False
-        local_dir = "cache/album_art/"
-        image_name = "AlbumImage_resize.PNG"
-        if should_download_album or not os.path.exists(f"{local_dir}{image_name}"):
+        if self._art_future is not None:
+            album_art = self._art_future.result()
+            self._art_future = None
+        else:
+            album_art = self.load_album_art(track)
+        local_dir, image_name, did_refresh_album_art = album_art
+
+        self.image_obj.draw_album_image(
+            image_file_name=image_name,
+            image_file_path=local_dir,
+            pos=pos, 
+            convert_image=did_refresh_album_art,
+            size=ALBUM_ART_SIZE,
+        )
+
+
+    def prefetch_album_art(self, track: SpotifyTrackMetadata) -> None:
+        """
+        Starts loading the album art in the background. The next build_album_art() waits for it.
+        """
+        self._art_future = self._pool.submit(self.load_album_art, track)
+
+
+    def load_album_art(self, track: SpotifyTrackMetadata) -> Tuple[str, str, bool]:
+        """
+        Finds the resized album art for the track in the cache, downloading it on a miss.
+
+        Returns:
+            (filepath, filename, convert_image) of the image to draw. Falls back to NA.png if the download fails.
+        """
+        did_refresh_album_art = True
+        local_dir = ALBUM_ART_DIR
+        image_name = self.get_album_art_cache_name(track)
+        if image_name in self._album_art_lru:
+            self._album_art_lru.move_to_end(image_name)
+            logger.info(f"Using cached album art {local_dir}{image_name}")
+        else:
             newly_saved_image = self.fetch_and_resize_album_art(
                 track_image_link=track.track_image_link, 
                 local_dir=local_dir,
-                image_name="AlbumImage.PNG",
-                dimensions=(120, 120),
+                image_name=image_name,
+                dimensions=ALBUM_ART_SIZE,
             )
             if newly_saved_image is None:
                 logger.warning("Failed to save new album image, drawing NA.png")
                 local_dir = "Icons/album_na/"
                 image_name = "NA.png"
+                did_refresh_album_art = False
             else:
                 local_dir, image_name = newly_saved_image
-                did_refresh_album_art = True
+                self._album_art_lru[image_name] = None
+        return local_dir, image_name, did_refresh_album_art
 
-        self.image_obj.draw_album_image(
-            image_file_name=image_name,
-            image_file_path=local_dir,
-            pos=pos, 
-            convert_image=did_refresh_album_art,
+
+    def get_album_art_cache_name(self, track: SpotifyTrackMetadata) -> str:
+        """
+        Returns the file name of the resized album art cached for the given track.
+        """
+        return f"{track.album_art_key}_120L.png"
+
+
+    def scan_album_art_cache(self) -> OrderedDict:
+        """
+        Lists the album art already in the cache, least recently used first. Only done once at startup,
+        afterwards the cache contents are tracked in memory. Files left behind by older versions are removed.
+        """
+        entries = []
+        for entry in os.scandir(ALBUM_ART_DIR):
+            if entry.name in LEGACY_ALBUM_ART_FILES:
+                os.remove(entry.path)
+                logger.info(f"Removed unused {entry.path}")
+            elif entry.name.endswith("_120L.png"):
+                entries.append(entry)
+        return OrderedDict(
+            (entry.name, None) for entry in sorted(entries, key=lambda entry: entry.stat().st_atime)
         )
 
 
+    def evict_album_art_cache(self) -> None:
+        """
+        Removes the least recently used album art from the cache, keeping at most ALBUM_ART_CACHE_SIZE albums.
+        """
+        evicted = 0
+        while len(self._album_art_lru) > ALBUM_ART_CACHE_SIZE:
+            image_name, _ = self._album_art_lru.popitem(last=False)
+            dither_name = f"{os.path.splitext(image_name)[0]}_dither.PNG"
+            for path in (f"{ALBUM_ART_DIR}{image_name}", f"{ALBUM_ART_DIR}{dither_name}"):
+                if os.path.exists(path):
+                    os.remove(path)
+            evicted += 1
+        if evicted:
+            logger.info(f"Evicted {evicted} album art files from {ALBUM_ART_DIR}")
+
+
     def fetch_and_resize_album_art(
         self,
         track_image_link: str, 
@@ -188,42 +353,55 @@ class Calendar:
         dimensions: Tuple[int, int],
     ) -> Optional[Tuple[int, int]]:
         """
-        Downloads the album art from the given track image link and saves it with the specified album image name.
-        The downloaded image is then resized.
+        Downloads the album art from the given track image link, then resizes it and saves it as image_name.
         
         Args:
             track_image_link (str): The URL of the track image.
-            album_image_name (str): The name of the album image file (default is "AlbumImage.PNG").
+            local_dir (str): The directory to save the resized album art in.
+            image_name (str): The file name of the resized album art.
+            dimensions (Tuple[int, int]): The maximum size of the resized album art.
 
         Returns:
-            (filename, filepath) if the album art was successfully downloaded and resized, else None.
+            (filepath, filename) if the album art was successfully downloaded and resized, else None.
         """
         logger.info(f"Fetching and resizing album art from {track_image_link}...")
-        os.makedirs(local_dir, exist_ok=True)
+        self.ensure_dir(local_dir)
         try:
             start = dt.now()
-            image_data = requests.get(track_image_link, timeout=25).content
+            image_data = _session.get(track_image_link, timeout=(3.05, 10)).content
             logger.info(f"Download took {(dt.now() - start).total_seconds()} seconds.")
         except requests.exceptions.RequestException as e:
             logger.error("Failed to download %s: %s", track_image_link, e)
             return None
-        image_path = f"{local_dir}{image_name}"
-        with open(image_path, 'wb') as handler:
-            handler.write(image_data)
 
-        outfile = os.path.splitext(image_name)[0] + f"_resize.PNG"
         try:
-            im = Image.open(image_path)
-            im.thumbnail(dimensions)
-            im = im.convert("L")
-            im.save(f"{local_dir}{outfile}", "PNG")
-            logger.info(f"Saved resized image to {local_dir}{outfile}.")
-            return (local_dir, outfile)
+            # Decode straight from the downloaded bytes, the original image is never needed on disk
+            im = Image.open(io.BytesIO(image_data))
+            # Let libjpeg scale down and decode to grayscale in one step, then refine to the exact size
+            im.draft("L", dimensions)
+            # draft() already brought the JPEG close to size, so bilinear is enough for the last step
+            im.thumbnail(dimensions, Image.Resampling.BILINEAR)
+            if im.mode != "L":
+                # PNG/WebP art ignores draft(), JPEGs are already grayscale here
+                im = im.convert("L")
+            im.save(f"{local_dir}{image_name}", "PNG", compress_level=1, optimize=False)
+            self.image_obj.add_resized_album_image(f"{local_dir}{image_name}", im)
+            logger.info(f"Saved resized image to {local_dir}{image_name}.")
+            return (local_dir, image_name)
         except IOError as e:
-            logger.error(f"Failed to resize {image_name}: {e}")
+            logger.error(f"Failed to resize {track_image_link}: {e}")
             return None
 
 
+    def ensure_dir(self, path: str) -> None:
+        """
+        Creates the directory if needed. Each directory is only checked once per process.
+        """
+        if path not in Calendar._ensured_dirs:
+            os.makedirs(path, exist_ok=True)
+            Calendar._ensured_dirs.add(path)
+
+
     def build_track_info(self, track: SpotifyTrackMetadata, left: int, bottom: int) -> None:
         self.image_obj.draw_track_context(
             track_name=track.track_name, 
@@ -1,24 +1,38 @@
 import json
+from dataclasses import dataclass
+from functools import cache
+from pathlib import Path
 
 from lib.clock_logging import logger
 
+@cache
+def load_settings() -> dict:
+    """
+    Load and parse config/display_settings.json. The file is only read once per process.
+    """
+    return json.loads(Path("config/display_settings.json").read_text(encoding="utf-8"))
+
+@dataclass(frozen=True)
 class DisplaySettings:
-    def __init__(self):
-        with open("config/display_settings.json", encoding="utf-8") as f:
-            settings = json.load(f)
-            # main settings
-            self.load_main_settings(settings["main_settings"])
+    # it is not recommended to set sleep_epd to False as it might damage the display
+    sleep_epd: bool
+    four_gray_scale: bool
+    # save every drawn image to test_output/ even when drawing to the EPD
+    debug_save_png: bool = False
 
-    def load_main_settings(self, main_settings: dict) -> None:
+    @classmethod
+    def from_main_settings(cls, main_settings: dict) -> "DisplaySettings":
         """
-        Load the main settings from the provided dictionary.
+        Build the settings from the provided dictionary.
 
         Parameters:
         main_settings (dict): A dictionary containing the main settings.
         """
-        # it is not recommended to set sleep_epd to False as it might damage the display
-        self.sleep_epd = main_settings["sleep_epd"]
-        self.four_gray_scale = main_settings["four_gray_scale"]
+        return cls(
+            sleep_epd=main_settings["sleep_epd"],
+            four_gray_scale=main_settings["four_gray_scale"],
+            debug_save_png=main_settings.get("debug_save_png", False),
+        )
 
 
-display_settings = DisplaySettings()
+display_settings = DisplaySettings.from_main_settings(load_settings()["main_settings"])
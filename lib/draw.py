@@ -1,14 +1,58 @@
 import os
-import subprocess
 from time import time
 from datetime import datetime
-from typing import List, Optional, Tuple
+from functools import lru_cache
+from typing import Dict, List, Optional, Tuple
 
-from PIL import Image, ImageFont, ImageDraw, ImageMath
+from PIL import Image, ImageFont, ImageDraw
 
 from lib.clock_logging import logger
 from lib.display_settings import display_settings
 
+@lru_cache(maxsize=256)
+def get_text_bbox(font: ImageFont.FreeTypeFont, text: str) -> Tuple[int, int, int, int]:
+    """
+    Memoized font.getbbox(). Track, artist and context names repeat across redraws.
+    """
+    return font.getbbox(text)
+
+@lru_cache(maxsize=64)
+def find_end_of_line(font: ImageFont.FreeTypeFont, text: str, width: int) -> Tuple[int, int]:
+    """
+    Finds the longest first line of text that fits in width, breaking after whitespace or at the end of the text.
+    Returns (end index, bottom of the line), the end index is -1 if not even the first word fits.
+    """
+    breaks = [i for i in range(1, len(text) + 1) if i == len(text) or text[i - 1].isspace()]
+    end_index, bottom = -1, get_text_bbox(font, text)[3]
+    # Lines only get wider as the break moves right, so binary search for the last break that fits
+    lo, hi = 0, len(breaks)
+    while lo < hi:
+        mid = (lo + hi) // 2
+        left, _, right, line_bottom = get_text_bbox(font, text[:breaks[mid]])
+        if right - left < width:
+            end_index, bottom = breaks[mid], line_bottom
+            lo = mid + 1
+        else:
+            hi = mid
+    return end_index, bottom
+
+@lru_cache(maxsize=64)
+def render_text_mask(font: ImageFont.FreeTypeFont, text: str, fontmode: str) -> Tuple[Image.Image, int]:
+    """
+    Rasterizes text once into an 'L' mask that can be pasted with any fill, the same labels are drawn every redraw.
+    Returns the mask and the x offset of its left edge from the text origin.
+    """
+    left, _, right, bottom = get_text_bbox(font, text)
+    x_offset = min(left, 0)
+    mask = Image.new('L', (max(right - x_offset, 1), max(bottom, 1)), 0)
+    mask_draw = ImageDraw.Draw(mask)
+    mask_draw.fontmode = fontmode
+    mask_draw.text((-x_offset, 0), text, font=font, fill=255)
+    return mask, x_offset
+
+# White, light gray, dark gray and black: the four levels the EPD can show in 4-gray mode
+FOUR_GRAY_PALETTE = [255, 255, 255, 192, 192, 192, 128, 128, 128, 0, 0, 0] + [0] * (256 - 4) * 3
+
 class Draw:
     """ 
     Draw to EPaper - Alex Scott 2024
@@ -20,6 +64,12 @@ class Draw:
     Made in companion with the Waveshare 4.2inch e-Paper Module
     https://www.waveshare.com/wiki/4.2inch_e-Paper_Module
     """
+    # Fonts and icons are shared by all Draw instances, see load_resources()
+    _resources_loaded = False
+    DSfnt10, DSfnt20 = None, None
+    playlist_icon, artist_icon, album_icon, dj_icon, collection_icon, failure_icon = None, None, None, None, None, None
+    palette_img = None
+
     def __init__(self, local_run: bool = False):
         self.local_run = local_run
         self.width, self.height = 264, 176
@@ -32,30 +82,25 @@ class Draw:
         os.makedirs("cache", exist_ok=True)
         os.makedirs("cache/album_art", exist_ok=True)
         self.dir_path = os.path.abspath('cache/album_art')
+        os.makedirs("test_output", exist_ok=True)
 
         self.image_mode = 'L' if self.ds.four_gray_scale else '1'
-        if self.ds.four_gray_scale:
-            # Create four grayscale color palette
-            subprocess.run([
-                'convert', '-size', '1x4', 
-                'xc:#FFFFFF', 
-                'xc:#C0C0C0', 
-                'xc:#808080', 
-                'xc:#000000', 
-                '+append', 
-                os.path.join(self.dir_path, 'palette.PNG')
-            ], check=True)
-        
+
         self.image_obj = Image.new(self.image_mode, (self.width, self.height), 255)
         self.image_draw = ImageDraw.Draw(self.image_obj)
+        # (key, image) of the last rendered calendar, it only changes a few times a day
+        self._calendar_cache: Optional[Tuple[tuple, Image.Image]] = None
+        # Album art resized by this process, handed over in memory so it isn't read back from disk
+        self._resized_album_images: Dict[str, Image.Image] = {}
 
-    def load_resources(self):
+    @classmethod
+    def load_resources(cls):
         """
         Load local resources. 
 
         This method loads fonts and icons from the /ePaperFonts and /Icons directories respectively.
-        It initializes several instance variables with these resources. The fonts are loaded with 
-        different sizes (16, 32, 64) and the icons are loaded as images.
+        It initializes several class variables with these resources, once per process. The fonts are loaded with 
+        different sizes (16, 32, 64) and the icons are loaded as fully decoded images in the drawing mode.
 
         Fonts:
         - DSfnt16, DSfnt32, DSfnt64: Fonts from the Nintendo-DS-BIOS.ttf file.
@@ -67,27 +112,45 @@ class Draw:
                 - album_icon: Icon for album.
                 - dj_icon: Icon for DJ.
                 - collection_icon: Icon for collection.
+
+        Palette:
+        - palette_img: 'P' image holding FOUR_GRAY_PALETTE, used to dither album art.
         """
-        self.DSfnt10, self.DSfnt20 = None, None
-        self.playlist_icon, self.artist_icon, self.album_icon, self.dj_icon, self.collection_icon, self.failure_icon = None, None, None, None, None, None
+        if cls._resources_loaded:
+            return
         font_sizes = [10, 20]
         font_files = ['NDS12.ttf']
         for font_file in font_files:
             for size in font_sizes:
                 font_attribute = f'DSfnt{size}'
-                setattr(self, font_attribute, ImageFont.truetype(f'ePaperFonts/{font_file}', size))
+                setattr(cls, font_attribute, ImageFont.truetype(f'ePaperFonts/{font_file}', size))
 
+        # Icons are converted to the drawing mode up front, otherwise every paste() converts them again
+        icon_mode = 'L' if display_settings.four_gray_scale else '1'
         music_context_icons = ['playlist', 'artist', 'album', 'dj', 'collection', 'failure']
         for icon in music_context_icons:
-            setattr(self, f'{icon}_icon', Image.open(f'Icons/music_context/{icon}.png'))
+            icon_image = Image.open(f'Icons/music_context/{icon}.png').convert(icon_mode)
+            setattr(cls, f'{icon}_icon', icon_image)
+
+        cls.palette_img = Image.new('P', (1, 1))
+        cls.palette_img.putpalette(FOUR_GRAY_PALETTE)
+        cls._resources_loaded = True
 
 
     def clear_image(self) -> None:
         """
-        Clears the current image by creating a new blank image filled with the color white (255).
+        Clears the current image by filling it with the color white (255).
+        The image buffer and its ImageDraw are reused across redraws rather than reallocated.
         """
-        self.image_obj = Image.new(self.image_mode, (self.width, self.height), 255)
-        self.image_draw = ImageDraw.Draw(self.image_obj)
+        self.image_obj.paste(255, (0, 0, self.width, self.height))
+
+    def draw_text(self, xy: Tuple[int, int], text: str, font: ImageFont.FreeTypeFont, fill=0) -> None:
+        """
+        Same as ImageDraw.text(), but pastes a cached mask instead of rasterizing the glyphs again.
+        """
+        mask, x_offset = render_text_mask(font, text, self.image_draw.fontmode)
+        x, y = xy
+        self.image_obj.paste(fill, (x + x_offset, y), mask)
 
     def save_png(self, file_name: str) -> None:
         """
@@ -96,9 +159,7 @@ class Draw:
         Args:
             file_name (str): The name of the file to save the image as.
         """
-        output_dir = "test_output"
-        os.makedirs(output_dir, exist_ok=True)
-        self.image_obj.save(os.path.join(output_dir, f"{file_name}.png"))
+        self.image_obj.save(os.path.join("test_output", f"{file_name}.png"), compress_level=1, optimize=False)
 
 
     # ---- DRAWING FUNCs ----------------------------------------------------------------------------
@@ -149,31 +210,48 @@ class Draw:
         image_file_path, 
         pos: tuple, 
         convert_image: bool=True,
+        size: Optional[Tuple[int, int]] = None,
     ) -> None:
         """
         Draws the album image on the ePaper display.
 
         Parameters:
-        image_file_name (str, optional): The name of the album image file. Defaults to "AlbumImage_resize.PNG".
+        image_file_name (str): The name of the album image file.
+        image_file_path (str): The directory containing the album image file.
         pos (tuple, optional): The position (x, y) where the album image should be pasted on the display. Defaults to (0, 0).
         convert_image (bool, optional): Flag indicating whether to convert the image to the specified image mode. Defaults to True.
+        size (tuple, optional): The maximum (width, height) of the pasted image. Larger images are scaled down to fit.
         """
-        album_image = Image.open(f"{image_file_path}{image_file_name}")
-        if convert_image:
-            album_image = album_image.convert(self.image_mode)
-            
-            if self.ds.four_gray_scale:
-                before_dither = time()
-                if "NA" in image_file_name:
-                    album_image_filepath = self.dither_album_art("NA")
-                else:
-                    album_image_filepath = self.dither_album_art()
-                after_dither = time()
-                logger.info("* Dithering took %.2f seconds *", after_dither - before_dither)
-                album_image = Image.open(album_image_filepath)
-
+        album_image = self.load_album_image(f"{image_file_path}{image_file_name}", convert_image, size)
         self.image_obj.paste(album_image, pos)
 
+    @lru_cache(maxsize=8)
+    def load_album_image(
+        self,
+        image_path: str,
+        convert_image: bool,
+        size: Optional[Tuple[int, int]],
+    ) -> Image:
+        """
+        Loads the album image to paste, see draw_album_image() for the parameters.
+        The last few images are kept in memory, so alternating between recent albums doesn't touch the disk.
+        """
+        if convert_image and self.ds.four_gray_scale:
+            # The dithered image is all we need, don't decode the resized one
+            before_dither = time()
+            album_image = self.dither_album_art(image_path)
+            after_dither = time()
+            logger.info("* Dithering took %.2f seconds *", after_dither - before_dither)
+        else:
+            album_image = self.open_resized_album_image(image_path)
+            if convert_image:
+                album_image = album_image.convert(self.image_mode)
+
+        if size is not None:
+            album_image.thumbnail(size)
+        album_image.load()
+        return album_image
+
 
     def draw_song_title(self, text: str, x: int, y: int, linespacing: int = 0, dry_run: bool = True) -> int:
         """
@@ -181,12 +259,12 @@ class Draw:
         First, we try to draw in font size 20 if the text fits on one line. 
         If it doesn't, we draw in font size 10, wrapping once if necessary.
         """
-        _, _, width, height = self.DSfnt20.getbbox(text)
+        _, _, width, height = get_text_bbox(self.DSfnt20, text)
         does_text_fit = width < self.width - x
         if does_text_fit:
             # Fits on one line with font size 20
             if not dry_run:
-                self.image_draw.text((x, y), text, font=self.DSfnt20)
+                self.draw_text((x, y), text, font=self.DSfnt20)
             return y + height
         return self.draw_small_text(
             text=text, x=x, y=y, linespacing=linespacing, dry_run=dry_run,
@@ -229,35 +307,17 @@ class Draw:
             return init_y
 
         # Find a first line that fits
-        def find_end_of_line(s, w):
-            left, top, right, bottom = font.getbbox(s)
-            avg_char_width = right / len(s)
-
-            end_index = int(w / avg_char_width)
-            if end_index >= len(s):
-                end_index = len(s)
-            while end_index >= 0:
-                if end_index == len(s) or s[end_index-1].isspace():
-                    left, top, right, bottom = font.getbbox(s[:end_index])
-                    if right - left < w:
-                        # It fits
-                        return end_index, bottom
-                # Doesn't fit yet, reduce line size by 1 and try again.
-                end_index -= 1
-
-            return end_index, bottom
-
-        first_line_end, bottom = find_end_of_line(text, width - indent)
+        first_line_end, bottom = find_end_of_line(font, text, width - indent)
         if first_line_end < 0:
             # Can't fit one word... just overflow
-            self.image_draw.text((init_x + indent, init_y), text,
-                font=font, fill=textcolor)
+            if not dry_run:
+                self.draw_text((init_x + indent, init_y), text,
+                    font=font, fill=textcolor)
             return init_y + bottom
 
         # Now end is the index where we'll break
-        left, top, right, bottom = font.getbbox(text[:first_line_end])
         if not dry_run:
-            self.image_draw.text((init_x + indent, init_y), text[:first_line_end],
+            self.draw_text((init_x + indent, init_y), text[:first_line_end],
                 font=font, fill=textcolor)
 
         if first_line_end == len(text):
@@ -267,13 +327,13 @@ class Draw:
         
         second_line_init_y = init_y + bottom + linespacing
         remaining_text = text[first_line_end:]
-        second_line_end, second_bottom = find_end_of_line(remaining_text, width)
+        second_line_end, second_bottom = find_end_of_line(font, remaining_text, width)
         second_line_text = remaining_text
         if 0 < second_line_end < len(remaining_text):
             # We couldn't fit in two lines so just cut off with '...'
             second_line_text = f"{remaining_text[:second_line_end]}..."
         if not dry_run:
-            self.image_draw.text(
+            self.draw_text(
                 (init_x, second_line_init_y), 
                 second_line_text,
                 font=font, 
@@ -323,11 +383,25 @@ class Draw:
             dry_run=False,
         )
 
+    def get_calendar_key(self, dt: datetime) -> tuple:
+        """
+        Everything the calendar panel depends on, the panel looks the same for any two times with equal keys.
+        """
+        return (dt.date(), self.get_greeting(dt))
+
     def draw_calendar(self, dt: datetime, x: int, y: int) -> tuple:
-        self.image_draw.rectangle([(x,y),(self.width, self.height)],fill = "#808080")    
-        date = dt.strftime("%A %b %d")
-        self.image_draw.text((x + 10, y + 8), date, font=self.DSfnt20, fill="#ffffff")
-        self.image_draw.text((x + 10, y + 35), self.get_greeting(dt), font=self.DSfnt10, fill="#ffffff")
+        greeting = self.get_greeting(dt)
+        calendar_key = self.get_calendar_key(dt) + (x, y)
+        if self._calendar_cache is None or self._calendar_cache[0] != calendar_key:
+            # A 1-bit canvas has no gray, and "#808080" would round to white under the white text
+            background = "#808080" if self.ds.four_gray_scale else "#000000"
+            calendar_image = Image.new(self.image_mode, (self.width - x, self.height - y), background)
+            calendar_draw = ImageDraw.Draw(calendar_image)
+            date = dt.strftime("%A %b %d")
+            calendar_draw.text((10, 8), date, font=self.DSfnt20, fill="#ffffff")
+            calendar_draw.text((10, 35), greeting, font=self.DSfnt10, fill="#ffffff")
+            self._calendar_cache = (calendar_key, calendar_image)
+        self.image_obj.paste(self._calendar_cache[1], (x, y))
 
     def get_greeting(self, dt: datetime) -> str:
         if 5 <= dt.hour < 10:
@@ -337,37 +411,68 @@ class Draw:
         else:
             return "gn r \u2665"
 
-    def dither_album_art(self, main_image_name: str = "AlbumImage") -> Optional[str]:
+    def dither_album_art(self, resize_path: str) -> Optional[Image.Image]:
         """
         Dithers the album art image using the Floyd-Steinberg algorithm.
 
-        The image is resized and the colors are remapped using a palette. The dithered image is then saved to a file.
+        The colors of the resized image are remapped using a palette. The dithered image is then saved to a file
+        named after the resized image, so dithered images of different albums coexist in the cache.
+
+        Parameters:
+        resize_path (str): The filepath of the resized album image.
 
         Returns:
-        str: dithered image filepath if the dithering was successful, None otherwise.
+        Image: the dithered image if the dithering was successful, None otherwise.
         """
         # Define the file paths
-        palette_path = os.path.join(self.dir_path, 'palette.PNG')
-        resize_path = os.path.join(self.dir_path, f'{main_image_name}_resize.PNG')
+        main_image_name = os.path.splitext(os.path.basename(resize_path))[0]
         dither_path = os.path.join(self.dir_path, f'{main_image_name}_dither.PNG')
 
-        # Check if the files exist
-        if not os.path.exists(resize_path) or not os.path.exists(palette_path):
-            logger.error("Error: File %s not found.", resize_path if not os.path.exists(resize_path) else palette_path)
-            return None
+        try:
+            # Album art is dithered once, when it is first drawn
+            dithered_image = Image.open(dither_path)
+            dithered_image.load()
+            self._resized_album_images.pop(resize_path, None)
+            return dithered_image
+        except FileNotFoundError:
+            pass
 
         # Remap the colors in the image
         start_time = time()
-        subprocess.run(['convert', resize_path, '-dither', 'Floyd-Steinberg', '-remap', palette_path, dither_path], check=True)
+        try:
+            # quantize() only remaps RGB images, an 'L' image's gray values would be taken as palette indices
+            album_image = self.open_resized_album_image(resize_path).convert('RGB')
+            dithered_image = album_image.quantize(palette=self.palette_img, dither=Image.Dither.FLOYDSTEINBERG)
+            # Hand back the bitmap we already have instead of re-reading the file we just wrote
+            dithered_image = dithered_image.convert('L')
+            dithered_image.save(dither_path, 'PNG', compress_level=1, optimize=False)
+        except FileNotFoundError:
+            logger.error("Error: File %s not found.", resize_path)
+            return None
+        except IOError as e:
+            logger.error("Error: Failed to dither %s: %s", resize_path, e)
+            return None
         end_time = time()
         logger.info("* Dithering %s took %.2f seconds *", os.path.basename(dither_path), end_time - start_time)
 
-        if not os.path.exists(dither_path):
-            logger.error("Error: File %s not found.", dither_path)
-            return None
+        return dithered_image
 
-        return dither_path
 
+    def add_resized_album_image(self, image_path: str, image: Image.Image) -> None:
+        """
+        Hands over album art that was just resized and saved to image_path, so drawing it doesn't decode the file again.
+        """
+        self._resized_album_images[image_path] = image
+
+    def open_resized_album_image(self, image_path: str) -> Image.Image:
+        """
+        Returns the resized album art handed over by add_resized_album_image(), or loads it from disk.
+        """
+        image = self._resized_album_images.pop(image_path, None)
+        if image is None:
+            image = Image.open(image_path)
+            image.load()
+        return image
 
     def get_image_obj(self) -> Image:
         """
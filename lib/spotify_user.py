@@ -1,10 +1,14 @@
+import hashlib
 import json
 import logging
 import os
+from collections import deque
 from dataclasses import dataclass, field
 from dataclasses_json import dataclass_json
 from datetime import datetime as dt
-from typing import Any, Dict, Optional, Tuple
+from functools import lru_cache
+from time import monotonic, sleep
+from typing import Any, Deque, Dict, List, Optional, Tuple
 
 import requests
 from requests.exceptions import ReadTimeout
@@ -15,6 +19,16 @@ from lib.clock_logging import logger
 
 spotify_logger = logging.getLogger('spotipy.client')
 
+# Backoff when a 429 comes without a Retry-After header
+SPOTIFY_DEFAULT_RETRY_AFTER_SEC = 10
+# Spotify starts answering 429 at roughly 10 requests per second
+SPOTIFY_MAX_REQUESTS = 10
+SPOTIFY_REQUEST_WINDOW_SEC = 1.0
+# Album art is drawn at 120x120, smaller images would have to be upscaled
+ALBUM_IMAGE_MIN_WIDTH = 120
+# Playlist, album and artist names are reused for this long before asking Spotify again
+CONTEXT_NAME_TTL_SEC = 3600
+
 @dataclass_json
 @dataclass
 class SpotifyTrackMetadata:
@@ -24,7 +38,14 @@ class SpotifyTrackMetadata:
     context_name: str  # context name to be displayed
     track_image_link: str  # link to track image
     album_name: str
-    timestamp: int = field(compare=False)
+    timestamp: float = field(compare=False)  # unix time the track was fetched
+
+    @property
+    def album_art_key(self) -> str:
+        """
+        Short, filename-safe key for the album art, derived from track_image_link.
+        """
+        return hashlib.sha1(self.track_image_link.encode()).hexdigest()[:16]
 
 
 class SpotifyUser:
@@ -41,7 +62,17 @@ class SpotifyUser:
         self.oauth = None
         self.oauth_token_info = None
         self.sp = None
+        # While rate limited, get_most_recent_spotipy_info() reuses _last_spot_val until this monotonic time
+        self._rate_limited_until = float('-inf')
+        self._last_spot_val: Optional[SpotifyTrackMetadata] = None
+        self._request_times: Deque[float] = deque(maxlen=SPOTIFY_MAX_REQUESTS)
+        # In-memory copy of context.json, so it is only read from disk once per process
+        self._cached_track: Optional[SpotifyTrackMetadata] = None
+        # Context names keyed on (context_type, context_uri, time bucket), see fetch_context_name()
+        self._context_name_cache = lru_cache(maxsize=64)(self.fetch_context_name)
         self.load_credentials()
+        # Built once, it is only asked for a new token when the current one expires
+        self.oauth = spotipy.oauth2.SpotifyOAuth(self.spot_client_id, self.spot_client_secret, self.redirect_uri, scope=self.scope, cache_path=self.cache, requests_timeout=10)
         self.update_spotipy_token()
 
     def load_credentials(self):
@@ -54,9 +85,14 @@ class SpotifyUser:
         """ 
         Updates Spotify Token from self.oauth if token_info is stale. 
         """
-        self.oauth = spotipy.oauth2.SpotifyOAuth(self.spot_client_id, self.spot_client_secret, self.redirect_uri, scope=self.scope, cache_path=self.cache, requests_timeout=10)
+        if self.oauth_token_info and not self.oauth.is_token_expired(self.oauth_token_info):
+            # The token in memory is still good, no need to touch the auth cache
+            return True
         try:
-            self.oauth_token_info = self.oauth.get_cached_token()
+            if self.oauth_token_info:
+                self.oauth_token_info = self.oauth.refresh_access_token(self.oauth_token_info['refresh_token'])
+            else:
+                self.oauth_token_info = self.oauth.get_cached_token()
         except requests.exceptions.ConnectionError:
             logger.error("Failed to update cached_token(): ConnectionError")
             return False
@@ -70,9 +106,13 @@ class SpotifyUser:
             code = self.oauth.parse_response_code(response)
             if code:
                 print("Found Spotify auth code in Request URL! Trying to get valid access token...")
-                token_info = self.oauth.get_access_token(code)
-                self.token = token_info['access_token']
-        self.sp = spotipy.Spotify(auth=self.token)
+                self.oauth_token_info = self.oauth.get_access_token(code)
+                self.token = self.oauth_token_info['access_token']
+        if self.sp is None:
+            # Built once and kept, so its keep-alive connections and spotipy's retry/backoff adapter survive token refreshes
+            self.sp = spotipy.Spotify(auth=self.token)
+        else:
+            self.sp.set_auth(self.token)
         logger.info("Spotify access_token granted")
         return True
 
@@ -80,9 +120,25 @@ class SpotifyUser:
         if not self.sp:
             logger.error("SpotipyObject not found")
             return None
+        if monotonic() < self._rate_limited_until:
+            logger.info(f"Rate limited, reusing last fetched Spotify track: {self._last_spot_val}")
+            return self._last_spot_val
+        track = self.fetch_most_recent_track()
+        if monotonic() >= self._rate_limited_until:
+            # Not rate limited while fetching, keep the result to fall back on during a backoff
+            self._last_spot_val = track
+        return track
+
+    def fetch_most_recent_track(self) -> Optional[SpotifyTrackMetadata]:
+        """
+        Fetches the currently playing track, falling back to the most recently played track.
+        """
         payload = self.fetch_current_track_from_spotipy()
         if payload and 'item' in payload:
             return self.extract_track_from_current_payload(payload)
+        if monotonic() < self._rate_limited_until:
+            # Rate limited, don't make it worse
+            return None
         recent_payload = self.fetch_recently_played_track_from_spotipy()
         if recent_payload and 'items' in recent_payload:
             return self.extract_track_from_recent_payload(recent_payload)
@@ -100,9 +156,12 @@ class SpotifyUser:
         """
         for _ in range(3):
             try:
+                self.throttle()
                 return self.sp.current_user_playing_track()
             except (SpotifyException, ReadTimeout) as e:
                 logger.error(e)
+                if isinstance(e, SpotifyException) and self.handle_rate_limit(e):
+                    return None
                 self.update_spotipy_token()
             except requests.exceptions.ConnectionError as e:
                 logger.error(e)
@@ -114,9 +173,12 @@ class SpotifyUser:
     def fetch_recently_played_track_from_spotipy(self) -> Optional[Dict[str, Any]]:
         for _ in range(3):
             try:
+                self.throttle()
                 return self.sp.current_user_recently_played(1)
             except (SpotifyException, ReadTimeout) as e:
                 logger.error(e)
+                if isinstance(e, SpotifyException) and self.handle_rate_limit(e):
+                    return None
                 if 'The access token expired' in str(e):
                     self.update_spotipy_token()
             except requests.exceptions.ConnectionError as e:
@@ -125,6 +187,30 @@ class SpotifyUser:
         logger.error(f"Failed to get current user's recently played track")
         return None
 
+    def throttle(self) -> None:
+        """
+        Blocks until another Spotify request fits in SPOTIFY_MAX_REQUESTS per SPOTIFY_REQUEST_WINDOW_SEC.
+        """
+        if len(self._request_times) == SPOTIFY_MAX_REQUESTS:
+            wait = self._request_times[0] + SPOTIFY_REQUEST_WINDOW_SEC - monotonic()
+            if wait > 0:
+                sleep(wait)
+        self._request_times.append(monotonic())
+
+    def handle_rate_limit(self, e: SpotifyException) -> bool:
+        """
+        If Spotify responded with 429, stops fetching until its Retry-After has passed.
+
+        Returns:
+            bool: True if the request was rate limited.
+        """
+        if e.http_status != 429:
+            return False
+        retry_after = int((e.headers or {}).get('Retry-After', SPOTIFY_DEFAULT_RETRY_AFTER_SEC))
+        logger.warning(f"Rate limited by Spotify, backing off for {retry_after} seconds")
+        self._rate_limited_until = monotonic() + retry_after
+        return True
+
 
     def extract_track_from_current_payload(self, recent: Dict[str, Any]) -> SpotifyTrackMetadata:
         """
@@ -167,7 +253,7 @@ class SpotifyUser:
         tracks = recent["items"]
         track = tracks[0]
         track_name, artists = track['track']['name'], track['track']['artists']
-        track_image_link = track['track']['album']['images'][0]['url']
+        track_image_link = self.pick_album_image_link(track['track']['album']['images'])
         album_name = track['track']['album']['name']
         artist_name = ', '.join(artist['name'] for artist in artists)
         context_type, context_name = self.get_context_from_json(track)
@@ -196,7 +282,23 @@ class SpotifyUser:
                 track_image_link: link to the track image
                 album_name: name of the album, or None if not a single user
         """
-        return recent['item']['album']['images'][0]['url'], recent['item']['album']['name']
+        return self.pick_album_image_link(recent['item']['album']['images']), recent['item']['album']['name']
+
+    def pick_album_image_link(self, images: List[Dict[str, Any]]) -> str:
+        """
+        Picks the smallest album image that is still at least ALBUM_IMAGE_MIN_WIDTH wide.
+        Spotify usually offers 640, 300 and 64 pixel versions, so this is typically the 300 pixel one.
+
+        Args:
+            images (List[Dict[str, Any]]): The album's images, widest first.
+
+        Returns:
+            str: link to the chosen image
+        """
+        for image in reversed(images):
+            if (image.get('width') or 0) >= ALBUM_IMAGE_MIN_WIDTH:
+                return image['url']
+        return images[0]['url']
 
 
     def get_context_from_json(self, track_json: Dict[str, Any]) -> Tuple[str, str]:
@@ -222,19 +324,13 @@ class SpotifyUser:
             track_info = track_json.get('track') or track_json.get('item')
             context_uri = track_info['album']['uri']
 
-        context_fetchers = {
-            'playlist': self.sp.playlist,
-            'album': self.sp.album,
-            'artist': self.sp.artist
-        }
-
-        fetcher = context_fetchers.get(context_type)
-
-        if fetcher:
+        if context_type in ('playlist', 'album', 'artist'):
             spotify_logger.disabled = True
             try:
-                context_name = fetcher(context_uri)['name']
-            except SpotifyException:
+                time_bucket = int(dt.now().timestamp() // CONTEXT_NAME_TTL_SEC)
+                context_name = self._context_name_cache(context_type, context_uri, time_bucket)
+            except SpotifyException as e:
+                self.handle_rate_limit(e)
                 if context_type == 'playlist':
                     context_name = "DJ"
         elif context_type == 'collection':
@@ -243,23 +339,49 @@ class SpotifyUser:
         spotify_logger.disabled = False
         return context_type, context_name
 
+    def fetch_context_name(self, context_type: str, context_uri: str, time_bucket: int) -> str:
+        """
+        Fetches the name of a playlist, album or artist. Called through self._context_name_cache, 
+        time_bucket is not used here, it only makes cached names expire every CONTEXT_NAME_TTL_SEC.
+        """
+        context_fetchers = {
+            # Only the name is needed, skip the playlist's tracks in the response
+            'playlist': lambda uri: self.sp.playlist(uri, fields='name'),
+            'album': self.sp.album,
+            'artist': self.sp.artist
+        }
+        self.throttle()
+        return context_fetchers[context_type](context_uri)['name']
+
     def write_track_to_cache(self, obj: SpotifyTrackMetadata) -> None:
         """
         Updates context.json with spotify user context.
         """
+        obj_dict = obj.to_dict()
+        # Write a temp file and swap it in, so a power cut can't leave a truncated context.json
+        tmp_path = f"{self.local_file_path}.tmp"
         try:
             logger.info(f"Writing to {self.local_file_path}...")
-            with open(self.local_file_path, 'w+', encoding='utf-8') as j_cxt:
-                json.dump(obj.to_dict(), j_cxt, indent=4)
-        except (FileNotFoundError, PermissionError) as e:
-            logger.error(f"Error writing {self.local_file_path}: {e}, contents: {obj.to_dict()}")
+            with open(tmp_path, 'w', encoding='utf-8') as j_cxt:
+                json.dump(obj_dict, j_cxt, indent=4)
+            os.replace(tmp_path, self.local_file_path)
+            self._cached_track = obj
+        except OSError as e:
+            logger.error(f"Error writing {self.local_file_path}: {e}, contents: {obj_dict}")
+            try:
+                os.remove(tmp_path)
+            except OSError:
+                pass
 
     def read_track_from_cache(self) -> Optional[SpotifyTrackMetadata]:
+        if self._cached_track is not None:
+            return self._cached_track
         if os.path.exists(self.local_file_path):
             with open(self.local_file_path, 'r', encoding='utf-8') as j_cxt:
                 try:
                     ctx = json.load(j_cxt)
                     obj = SpotifyTrackMetadata.from_dict(ctx)
+                    self._cached_track = obj
                     return obj
                 except (json.JSONDecodeError, IndexError) as e:
                     logger.error(f"Error reading {self.local_file_path}: {e}")
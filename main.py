@@ -2,75 +2,81 @@ from datetime import datetime as dt, timedelta
 from gpiozero import Button
 import logging
 import time
-from threading import Event, Lock, Thread
-from zoneinfo import ZoneInfo
+from threading import Event, Thread
 
 from lib.arg_parser import args
-from lib.calendar import Calendar
+from lib.calendar import Calendar, PACIFIC_TZ
 
 
 REFRESH_INTERVAL_SEC = 180
+# Right after a redraw the track is likely to change again (skipping songs), so poll faster for a while
+FAST_REFRESH_INTERVAL_SEC = 15
+FAST_REFRESH_WINDOW_SEC = 60
 
 if __name__ == "__main__":
     logging.getLogger().setLevel(logging.INFO)
 
     calendar = Calendar()
-    draw_lock = Lock()
     stop_event = Event()
+    # Set by the button, wakes refresh_loop up to draw right away
+    refresh_now = Event()
     button_cooldown = timedelta(seconds=1)
     last_button_press = dt.min
 
     def refresh_loop():
+        last_redraw = float('-inf')
         while not stop_event.is_set():
-            pacific_tz = ZoneInfo("America/Los_Angeles")
-            now = dt.now(pacific_tz)
-            if 2 <= now.hour < 6:
-                # Don't draw between 2AM and 6AM
-                time.sleep(REFRESH_INTERVAL_SEC)
+            now = dt.now(PACIFIC_TZ)
+            if 2 <= now.hour < 6 and not refresh_now.is_set():
+                # Don't draw between 2AM and 6AM unless asked to, sleep straight through to 6AM
+                wake_time = now.replace(hour=6, minute=0, second=0, microsecond=0)
+                timeout = (wake_time - now).total_seconds()
             else:
-                with draw_lock:
-                    print("Drawing from refresh_loop")
-                    calendar.draw()
-                time.sleep(REFRESH_INTERVAL_SEC)  # Sleep for refresh interval
+                refresh_now.clear()
+                start = time.monotonic()
+                print("Drawing from refresh_loop")
+                if calendar.draw():
+                    last_redraw = start
+                interval = REFRESH_INTERVAL_SEC
+                if start - last_redraw < FAST_REFRESH_WINDOW_SEC:
+                    interval = FAST_REFRESH_INTERVAL_SEC
+                # Sleep for whatever is left of the refresh interval, so drawing time doesn't add up into drift
+                elapsed = time.monotonic() - start
+                timeout = max(0.0, interval - elapsed)
+            # Returns early on a button press or shutdown
+            refresh_now.wait(timeout)
 
-    def button_listener():
-        while not stop_event.is_set():
-            if refresh_button.is_pressed:
-                now = dt.now()
-                if now - last_button_press > button_cooldown:  
-                    last_button_press = now
-                    with draw_lock:
-                        print("Drawing from button_listener")
-                        calendar.draw()
-            time.sleep(0.1)  # Prevent busy-waiting
+    def on_button_press():
+        """ Called by gpiozero on the button's falling edge, no thread polls the pin. """
+        global last_button_press
+        now = dt.now()
+        if now - last_button_press <= button_cooldown:
+            return
+        last_button_press = now
+        print("Refresh requested by button press")
+        refresh_now.set()
 
     def thread_supervisor():
         """ Restarts threads if they crash. """
-        global refresh_thread, button_thread
+        global refresh_thread
         while not stop_event.is_set():
             if not refresh_thread.is_alive():
                 print("[WARNING] Refresh thread restarted")
                 refresh_thread = Thread(target=refresh_loop, daemon=True)
                 refresh_thread.start()
 
-            if not button_thread.is_alive():
-                print("[WARNING] Button listener restarted")
-                button_thread = Thread(target=button_listener, daemon=True)
-                button_thread.start()
-
-            time.sleep(5)  # Check every 5 seconds
+            stop_event.wait(5)  # Check every 5 seconds
 
     if args.local:
         calendar.build_image()
     else:
-        refresh_button = Button(5)
+        refresh_button = Button(5, bounce_time=0.05)
+        refresh_button.when_pressed = on_button_press
 
         refresh_thread = Thread(target=refresh_loop, daemon=True)
-        button_thread = Thread(target=button_listener, daemon=True)
         supervisor_thread = Thread(target=thread_supervisor, daemon=True)
 
         refresh_thread.start()
-        button_thread.start()
         supervisor_thread.start()
 
         # Keep main thread alive
@@ -80,6 +86,7 @@ if __name__ == "__main__":
         except KeyboardInterrupt:
             print("Shutting down...")
             stop_event.set()
+            refresh_now.set()
             refresh_thread.join()
-            button_thread.join()
+            refresh_button.close()
             supervisor_thread.join()
\ No newline at end of file